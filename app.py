@@ -8,20 +8,235 @@ import shutil
 from PIL import Image
 import tempfile
 import ipaddress
+import struct
+import time
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = '/tmp/waifu2x_uploads'
 app.config['OUTPUT_FOLDER'] = '/tmp/waifu2x_results'
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'bmp', 'tif', 'tiff', 'tga', 'gif', 'webp'}
+# raw 업로드는 tmpfs(/dev/shm)에 스풀링, 이 크기를 넘으면 디스크(UPLOAD_FOLDER)로 넘김
+app.config['RAW_SPOOL_FOLDER'] = '/dev/shm/waifu2x_spool' if os.path.isdir('/dev/shm') else app.config['UPLOAD_FOLDER']
+app.config['RAW_SPOOL_MAX_MEMORY'] = 16 * 1024 * 1024
+app.config['RAW_CHUNK_SIZE'] = 64 * 1024
 
 # 필요한 디렉토리 생성
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+os.makedirs(app.config['RAW_SPOOL_FOLDER'], exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def sniff_image_header(header):
+    """
+    파일 앞부분 바이트만으로 이미지 형식과 애니메이션 여부를 판별합니다.
+    (확장자, 애니메이션 여부)를 반환하며, 헤더만으로 알 수 없으면 애니메이션 여부는 None,
+    형식을 알 수 없으면 (None, None)을 반환합니다.
+    """
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png', False
+    if header.startswith(b'\xff\xd8\xff'):
+        return '.jpg', False
+    if header.startswith(b'BM'):
+        return '.bmp', False
+    if header.startswith(b'II*\x00') or header.startswith(b'MM\x00*'):
+        return '.tif', False
+    if header.startswith(b'GIF87a') or header.startswith(b'GIF89a'):
+        # GIF 프레임 수는 헤더에 없으므로 프레임 분리 경로에서 판단
+        return '.gif', None
+    if len(header) >= 16 and header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        chunk = header[12:16]
+        if chunk in (b'VP8 ', b'VP8L'):
+            return '.webp', False
+        if chunk == b'VP8X' and len(header) >= 21 and not header[20] & 0x02:
+            # VP8X 플래그에 애니메이션 비트 (0x02)가 없으면 일반 WebP
+            return '.webp', False
+        # 애니메이션 비트가 있어도 프레임이 하나일 수 있으므로 프레임 수는 Pillow로 확인
+        return '.webp', None
+    return None, None
+
+def read_gif_frame_delays(gif_path):
+    """
+    GIF 블록 구조만 훑어서 프레임별 지연 시간(1/100초 단위)을 읽습니다.
+    LZW 데이터는 디코딩하지 않고 건너뜁니다.
+    """
+    def skip_sub_blocks(f):
+        while True:
+            size = f.read(1)
+            if not size or size[0] == 0:
+                return
+            f.seek(size[0], os.SEEK_CUR)
+
+    frame_delays = []
+    delay = 10  # 기본값 100ms
+    with open(gif_path, 'rb') as f:
+        header = f.read(13)
+        if len(header) < 13 or header[:3] != b'GIF':
+            raise ValueError('Not a GIF file')
+        if header[10] & 0x80:
+            # 전역 색상표 건너뛰기
+            f.seek(3 * (2 << (header[10] & 0x07)), os.SEEK_CUR)
+        while True:
+            block = f.read(1)
+            if not block or block == b'\x3b':
+                break
+            if block == b'\x21':
+                label = f.read(1)
+                if label == b'\xf9':
+                    # Graphic Control Extension: 다음 프레임의 지연 시간
+                    data = f.read(5)
+                    if len(data) == 5:
+                        delay = struct.unpack('<H', data[2:4])[0]
+                skip_sub_blocks(f)
+            elif block == b'\x2c':
+                descriptor = f.read(9)
+                if len(descriptor) < 9:
+                    break
+                if descriptor[8] & 0x80:
+                    # 지역 색상표 건너뛰기
+                    f.seek(3 * (2 << (descriptor[8] & 0x07)), os.SEEK_CUR)
+                f.seek(1, os.SEEK_CUR)  # LZW 최소 코드 크기
+                skip_sub_blocks(f)
+                frame_delays.append(float(delay))
+                delay = 10  # GCE는 바로 다음 이미지에만 적용
+            else:
+                break
+    return frame_delays
+
+def log_ingest_stats(kind, nbytes, started, cpu_started):
+    """업로드 수신에 걸린 시간과 MB당 CPU 시간을 기록합니다 (multipart/raw 경로 비교용)"""
+    elapsed = time.perf_counter() - started
+    cpu = time.thread_time() - cpu_started
+    mb = max(nbytes, 1) / (1024 * 1024)
+    app.logger.info(f"Ingest [{kind}] {nbytes} bytes: {elapsed * 1000:.1f}ms, CPU {cpu * 1000 / mb:.1f}ms/MB")
+
+def spool_raw_body(stream, content_length, process_id):
+    """
+    요청 본문을 청크 단위로 스풀 파일에 기록합니다.
+    RAW_SPOOL_MAX_MEMORY 이하는 tmpfs에 두고, 넘으면 디스크의 UPLOAD_FOLDER로 옮겨 이어서 기록합니다.
+    (입력 경로, 확장자, 애니메이션 여부, 바이트 수)를 반환합니다.
+    """
+    chunk_size = app.config['RAW_CHUNK_SIZE']
+    max_memory = app.config['RAW_SPOOL_MAX_MEMORY']
+
+    # 형식 판별에 필요한 앞부분만 먼저 읽음
+    header = b''
+    while len(header) < 32:
+        chunk = stream.read(32 - len(header))
+        if not chunk:
+            break
+        header += chunk
+
+    extension, is_animated = sniff_image_header(header)
+    if extension is None:
+        return None, None, None, len(header)
+
+    disk_dir = app.config['UPLOAD_FOLDER']
+    spool_dir = app.config['RAW_SPOOL_FOLDER']
+    if content_length and content_length > max_memory:
+        spool_dir = disk_dir
+    input_path = os.path.join(spool_dir, f"{process_id}{extension}")
+
+    def write_chunk(f, chunk):
+        # 버퍼 없는 파일이므로 부분 기록이 생기면 나머지를 이어서 기록
+        view = memoryview(chunk)
+        while view:
+            view = view[f.write(view):]
+
+    def spill_to_disk(f, written):
+        # tmpfs 파일을 디스크로 옮기고, 실패한 기록이 남긴 꼬리는 잘라냄
+        nonlocal spool_dir, input_path
+        f.close()
+        disk_path = os.path.join(disk_dir, f"{process_id}{extension}")
+        shutil.move(input_path, disk_path)
+        spool_dir, input_path = disk_dir, disk_path
+        f = open(input_path, 'r+b', buffering=0)
+        f.seek(written)
+        f.truncate()
+        return f
+
+    try:
+        f = open(input_path, 'wb', buffering=0)
+    except OSError as e:
+        if spool_dir == disk_dir:
+            raise
+        app.logger.warning(f"스풀 파일 생성 실패, 디스크로 전환: {str(e)}")
+        spool_dir = disk_dir
+        input_path = os.path.join(spool_dir, f"{process_id}{extension}")
+        f = open(input_path, 'wb', buffering=0)
+
+    written = 0
+    try:
+        chunk = header
+        while chunk:
+            if spool_dir != disk_dir and written + len(chunk) > max_memory:
+                # tmpfs 한도 초과: 지금까지의 내용을 디스크로 옮기고 이어서 기록
+                f = spill_to_disk(f, written)
+            try:
+                write_chunk(f, chunk)
+            except OSError as e:
+                # tmpfs가 가득 찬 경우 (ENOSPC 등) 한도 초과와 같은 방식으로 디스크로 전환
+                if spool_dir == disk_dir:
+                    raise
+                app.logger.warning(f"tmpfs 스풀 기록 실패, 디스크로 전환: {str(e)}")
+                f = spill_to_disk(f, written)
+                write_chunk(f, chunk)
+            written += len(chunk)
+            chunk = stream.read(chunk_size)
+    except Exception:
+        try:
+            f.close()
+        except:
+            pass
+        try:
+            os.remove(input_path)
+        except:
+            pass
+        raise
+    f.close()
+    return input_path, extension, is_animated, written
+
+def extract_params(source):
+    """요청(form 또는 query string)에서 처리 파라미터를 추출합니다"""
+    params = {
+        'mode': source.get('mode', 'noise_scale'),
+        'noise_level': source.get('noise_level', '1'),
+        'process': source.get('process', 'gpu'),
+        'tta': source.get('tta', '0') == '1',
+        'output_format': source.get('output_format', 'png')
+    }
+    
+    # 스케일링 모드 및 관련 파라미터 처리
+    scale_mode = source.get('scale_mode', 'ratio')
+    params['scale_mode'] = scale_mode
+    
+    if scale_mode == 'ratio':
+        params['scale_ratio'] = source.get('scale_ratio', '2.0')
+    elif scale_mode == 'width':
+        params['scale_width'] = source.get('scale_width', '')
+    elif scale_mode == 'height':
+        params['scale_height'] = source.get('scale_height', '')
+    return params
+
+def dispatch_processing(input_path, output_path, extension, params, is_animated=None):
+    """파일 확장자에 따라 다른 처리 방식 적용"""
+    extension = extension.lower()
+    if extension == '.gif':
+        # GIF 처리 경로
+        output_gif_path = output_path + '.gif'
+        return process_gif(input_path, output_gif_path, params)
+    elif extension == '.webp':
+        # WebP 처리 경로 (애니메이션 WebP 포함)
+        output_format = params['output_format']
+        output_webp_path = output_path + '.' + output_format
+        return process_webp(input_path, output_webp_path, params, is_animated)
+    else:
+        # 일반 이미지 처리 경로
+        output_img_path = output_path + '.' + params['output_format']
+        return process_image(input_path, output_img_path, params)
+
 def process_image(input_path, output_path, params):
     """이미지를 처리하는 함수"""
     try:
@@ -97,17 +312,10 @@ def split_gif_frames(gif_path, output_dir):
             app.logger.error(f"GIF 분리 실패: {stderr.decode()}")
             return False, stderr.decode()
         
-        # 지연 시간 추출
-        img = Image.open(gif_path)
-        frame_delays = []
-        try:
-            while True:
-                # 각 프레임의 지연 시간을 밀리초 단위로 저장 (기본값 100ms)
-                delay = img.info.get('duration', 100)
-                frame_delays.append(delay / 10)  # ImageMagick은 1/100초 단위 사용
-                img.seek(img.tell() + 1)
-        except EOFError:
-            pass  # 모든 프레임 처리 완료
+        # 지연 시간 추출 (ImageMagick과 같은 1/100초 단위, 프레임 디코딩 없이 블록만 읽음)
+        frame_delays = read_gif_frame_delays(gif_path)
+        if not frame_delays:
+            frame_delays = [10.0]
         
         app.logger.info(f"GIF frames split successfully")
         return True, frame_delays
@@ -209,13 +417,21 @@ def process_gif(input_path, output_path, params):
             pass
         app.logger.info(f"Cleaning up temporary directories")
 
-def process_webp(input_path, output_path, params):
-    """WebP 이미지 처리 (애니메이션 WebP 직접 처리)"""
+def process_webp(input_path, output_path, params, is_animated=None):
+    """
+    WebP 이미지 처리 (애니메이션 WebP 직접 처리)
+    is_animated를 헤더에서 이미 알고 있으면 Pillow로 파일을 다시 열지 않습니다.
+    """
     try:
-        img = Image.open(input_path)
-        is_animated = hasattr(img, 'n_frames') and img.n_frames > 1
+        img = None
+        if is_animated is None:
+            img = Image.open(input_path)
+            is_animated = hasattr(img, 'n_frames') and img.n_frames > 1
         
         if is_animated:
+            if img is None:
+                img = Image.open(input_path)
+            
             # 임시 디렉토리 생성
             frames_dir = tempfile.mkdtemp(prefix='waifu2x_webp_')
             processed_dir = tempfile.mkdtemp(prefix='waifu2x_processed_')
@@ -364,6 +580,9 @@ def process_webp(input_path, output_path, params):
 
 @app.route('/api/v1/process', methods=['POST'])
 def process():
+    # multipart 파싱까지 포함하도록 request.files 접근 전에 측정 시작
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    
     # 파일이 요청에 포함되어 있는지 확인
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -383,42 +602,18 @@ def process():
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{process_id}")
         
         file.save(input_path)
+        log_ingest_stats('multipart', request.content_length or os.path.getsize(input_path), started, cpu_started)
         
         # 요청에서 파라미터 추출
-        params = {
-            'mode': request.form.get('mode', 'noise_scale'),
-            'noise_level': request.form.get('noise_level', '1'),
-            'process': request.form.get('process', 'gpu'),
-            'tta': request.form.get('tta', '0') == '1',
-            'output_format': request.form.get('output_format', 'png')
-        }
-        
-        # 스케일링 모드 및 관련 파라미터 처리
-        scale_mode = request.form.get('scale_mode', 'ratio')
-        params['scale_mode'] = scale_mode
-        
-        if scale_mode == 'ratio':
-            params['scale_ratio'] = request.form.get('scale_ratio', '2.0')
-        elif scale_mode == 'width':
-            params['scale_width'] = request.form.get('scale_width', '')
-        elif scale_mode == 'height':
-            params['scale_height'] = request.form.get('scale_height', '')
-        
-        # 파일 확장자에 따라 다른 처리 방식 적용
-        extension = extension.lower()
-        if extension == '.gif':
-            # GIF 처리 경로
-            output_gif_path = output_path + '.gif'
-            success, result = process_gif(input_path, output_gif_path, params)
-        elif extension == '.webp':
-            # WebP 처리 경로 (애니메이션 WebP 포함)
-            output_format = params['output_format']
-            output_webp_path = output_path + '.' + output_format
-            success, result = process_webp(input_path, output_webp_path, params)
-        else:
-            # 일반 이미지 처리 경로
-            output_img_path = output_path + '.' + params['output_format']
-            success, result = process_image(input_path, output_img_path, params)
+        params = extract_params(request.form)
+        
+        # WebP는 헤더로 애니메이션 여부를 먼저 확인 (일반 WebP는 Pillow 디코딩 생략)
+        is_animated = None
+        if extension.lower() == '.webp':
+            with open(input_path, 'rb') as f:
+                _, is_animated = sniff_image_header(f.read(32))
+        
+        success, result = dispatch_processing(input_path, output_path, extension, params, is_animated)
         
         # 처리가 완료된 후 임시 입력 파일 삭제
         try:
@@ -435,6 +630,45 @@ def process():
     
     return jsonify({'error': 'File type not allowed'}), 400
 
+@app.route('/api/v1/process/raw', methods=['PUT', 'POST'])
+def process_raw():
+    """
+    이미지 원본 바이트를 요청 본문으로 받아 처리합니다 (application/octet-stream).
+    파라미터는 query string으로 전달하며, 형식은 파일 헤더로 판별합니다.
+    """
+    process_id = str(uuid.uuid4())
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{process_id}")
+    
+    # multipart 파서를 거치지 않고 본문을 바로 스풀 파일로 기록
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    try:
+        input_path, extension, is_animated, nbytes = spool_raw_body(
+            request.stream, request.content_length, process_id)
+    except Exception as e:
+        # 스풀 기록 실패나 클라이언트 연결 끊김
+        app.logger.error(f"요청 본문 수신 중 예외 발생: {str(e)}")
+        return jsonify({'error': f'Failed to receive request body: {str(e)}'}), 500
+    
+    if input_path is None:
+        if nbytes == 0:
+            return jsonify({'error': 'Empty request body'}), 400
+        return jsonify({'error': 'File type not allowed'}), 400
+    log_ingest_stats('raw', nbytes, started, cpu_started)
+    
+    params = extract_params(request.args)
+    success, result = dispatch_processing(input_path, output_path, extension, params, is_animated)
+    
+    # 처리가 완료된 후 스풀 파일 삭제
+    try:
+        os.remove(input_path)
+    except:
+        pass
+    
+    if success:
+        return send_file(result, as_attachment=True)
+    else:
+        return jsonify({'error': result}), 500
+
 @app.route('/api/v1/options', methods=['GET'])
 def options():
     """사용 가능한 옵션 목록을 반환합니다"""